@@ -2,7 +2,7 @@ import os
 import time
 import pandas as pd
 import ctypes
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
+from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageColor
 import textwrap
 from datetime import datetime, timedelta
 import re
@@ -11,8 +11,36 @@ import logging
 import logging.handlers
 import sys
 import glob
+import hashlib
+import io
+import json
+import zipfile
+import shlex
+import shutil
+import subprocess
+import urllib.request
+from xml.etree.ElementTree import fromstring, iterparse
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right
+import queue
+import threading
+import multiprocessing
+import sqlite3
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
 import pygame
 
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
 def resource_path(relative_path):
     if hasattr(sys, '_MEIPASS'):
         return os.path.join(sys._MEIPASS, relative_path)
@@ -52,213 +80,1180 @@ def read_config(file_path):
     
 
 
-config = read_config('values.txt')
-
-grace_period = int(config.get('grace_period', 5))  
-running_color = config.get('running', 'red')
-finished_color =  config.get('finished', 'white')
-yet_to_start_color =  config.get('yet_to_start', 'grey')
-skip_rows =  int(config.get('skip_rows', 2))
-run_frequency =  int(config.get('run_frequency', 60))
-display_rows = int(config.get('display_rows', 8))
-upcoming_color = config.get('upcoming_color', 'yellow')
-upcoming_event_in = int(config.get('upcoming_event_in', 600))
-#audio_alarm = bool(config.get("audio_alarm", False))
-raw_value = config.get("audio_alarm", "false")  
-audio_alarm = raw_value.strip().lower() in ["true", "1", "yes"]
-flash_color = config.get('flash_color', 'red')
-flash_freq =  int(config.get('flash_freq', 60))
-txt_size =  int(config.get('txt_size', 60))
-audio_before =  int(config.get('audio_before', 60))
-flash_before_minutes =  int(config.get('flash_before_minutes', 5))
-font_size = int(config.get('font_size', 35))
+def file_signature(file_path):
+    stat = os.stat(file_path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+def config_bool(value):
+    value = value.strip().lower()
+    if value in ["true", "1", "yes"]:
+        return True
+    if value in ["false", "0", "no", ""]:
+        return False
+    raise ValueError("expected True or False")
+
+def config_color(value):
+    ImageColor.getrgb(value)  # Raises ValueError for names Pillow cannot draw
+    return value
+
+def config_range(kind, low, high=None):
+    def parse(value):
+        value = kind(value)
+        if value < low or (high is not None and value > high):
+            raise ValueError(f"expected {low} to {high}" if high is not None else f"expected at least {low}")
+        return value
+    return parse
+
+def config_choice(*choices):
+    def parse(value):
+        value = value.strip().lower()
+        if value not in choices:
+            raise ValueError(f"expected one of {', '.join(choices)}")
+        return value
+    return parse
+
+def config_image_format(value):
+    return config_choice("png", "jpg", "bmp")(value.strip().lower().replace('jpeg', 'jpg'))
+
+# values.txt key: (module global, type, default, what has to be redone when it changes while running)
+# parse re-reads the planners, store rebuilds the event transitions, render redraws the board,
+# targets rebuilds the render targets, metrics resizes the timing windows, restart is only picked up by a new process,
+# None is read live
+config_schema = {
+    'grace_period': ('grace_period', config_range(int, 0), 5, 'parse'),
+    'running': ('running_color', config_color, 'red', 'render'),
+    'finished': ('finished_color', config_color, 'white', 'render'),
+    'yet_to_start': ('yet_to_start_color', config_color, 'grey', 'render'),
+    'skip_rows': ('skip_rows', config_range(int, 0), 2, 'parse'),
+    'run_frequency': ('run_frequency', config_range(int, 1), 60, None),
+    'display_rows': ('display_rows', config_range(int, 1), 8, 'render'),
+    'upcoming_color': ('upcoming_color', config_color, 'yellow', 'render'),
+    'upcoming_event_in': ('upcoming_event_in', config_range(int, 0), 600, 'store'),
+    'audio_alarm': ('audio_alarm', config_bool, False, None),
+    'flash_color': ('flash_color', config_color, 'red', 'render'),
+    'flash_freq': ('flash_freq', config_range(int, 0), 60, None),
+    'txt_size': ('txt_size', config_range(int, 1), 60, None),
+    'audio_before': ('audio_before', config_range(int, 0), 60, 'store'),
+    'flash_before_minutes': ('flash_before_minutes', config_range(int, 0), 5, 'store'),
+    'font_size': ('font_size', config_range(int, 1), 35, 'render'),
+    'cache_hash': ('cache_hash', config_bool, False, None),
+    'merge_workbooks': ('merge_workbooks', config_bool, False, None),
+    'schedule_snapshot': ('schedule_snapshot', config_bool, True, None),
+    'ingest_workers': ('ingest_workers', config_range(int, 0), 2, 'restart'),
+    'ingest_queue_size': ('ingest_queue_size', config_range(int, 1), 4, None),
+    'watch_debounce': ('watch_debounce', config_range(float, 0), 2.0, None),
+    'settle_timeout': ('settle_timeout', config_range(float, 0), 30.0, None),
+    'output_format': ('output_format', config_image_format, 'png', 'targets'),
+    'png_compress_level': ('png_compress_level', config_range(int, 0, 9), 1, None),
+    'jpeg_quality': ('jpeg_quality', config_range(int, 1, 100), 90, None),
+    'width': ('configured_width', config_range(int, 0), 0, 'targets'),
+    'height': ('configured_height', config_range(int, 0), 0, 'targets'),
+    'display_mode': ('display_mode', config_choice("wallpaper", "window", "none"), 'wallpaper', 'restart'),
+    'display_topmost': ('display_topmost', config_bool, False, 'restart'),
+    'http_port': ('http_port', config_range(int, 0, 65535), 0, 'restart'),
+    'http_host': ('http_host', str, '127.0.0.1', 'restart'),
+    'output_sinks': ('output_sinks', str, 'auto', None),
+    'push_url': ('push_url', str, '', None),
+    'desktop_command': ('desktop_command', str, '', None),
+    'metrics_file': ('metrics_file', str, '', None),
+    'metrics_window': ('metrics_window', config_range(int, 1), 200, 'metrics'),
+    'page_interval': ('page_interval', config_range(float, 0), 0.0, 'render'),
+    'max_pages': ('max_pages', config_range(int, 1), 5, 'render'),
+    'render_targets': ('render_targets', str, '', 'targets'),
+    'asset_check_interval': ('asset_check_interval', config_range(float, 0), 5.0, None),
+    'journal_file': ('journal_file', str, 'live_journal.db', 'restart'),
+}
+# Settings a parse depends on, handed to pool processes that read values.txt when they started
+parse_setting_names = ['skip_rows', 'grace_period', 'cache_hash', 'watch_debounce', 'settle_timeout']
+
+def load_config(file_path, current=None):
+    # A missing key takes its default, an invalid value keeps the current one so a typo never takes the board down
+    config = read_config(file_path)
+    settings = {}
+    for key, (name, kind, default, effect) in config_schema.items():
+        try:
+            settings[name] = kind(config[key]) if key in config else default
+        except ValueError as e:
+            settings[name] = default if current is None else current[name]
+            logger.warning(f"Invalid {key}={config[key]} in {file_path} ({e}), using {settings[name]}")
+    for key in config.keys() - config_schema.keys():
+        logger.warning(f"Unknown setting {key} in {file_path}, ignored")
+    return settings
+
+config_file = 'values.txt'
+config_signature = file_signature(config_file)
+globals().update(load_config(config_file))
+
+required_columns = ["IST(+ 5.5)", "DUR", "TELECAST", "DESCRIPTION", "CHANNEL", "LINE INPUT", "SOURCE", "CIRCUIT"]
+column_fractions = [0.15625, 0.05208, 0.1302, 0.24218, 0.10416, 0.10416, 0.10416, 0.10416]
+
+schedule_cache = {}
+directory_changed = threading.Event()
+parse_finished = threading.Event()
+event_store_cache = {}
+merged_cache = {}
+failed_planners = {}
+parse_executor = None
+ingest_pool = None
+ingest_jobs = {}
+ingest_lock = threading.Lock()
+rendered_store = None
+last_render = None
+alarm_queue = queue.Queue()
+alarmed_events = set()
+alarm_thread = None
+journal = None
+journal_lock = threading.Lock()
+journal_states = {}
+base_layer_cache = {}
+frame_cache = {}
+shown_page = {}
+screen_size = None
+text_measure_cache = {}
+wrap_cache = OrderedDict()
+wrap_cache_size = 4096
+display_queue = queue.Queue()
+board_state = {'version': 0}
+board_changed = threading.Condition()
+output_sink_registry = {}
+render_target_list = None
+render_pool = None
+wrap_lock = threading.Lock()
+asset_cache = {}
+asset_lock = threading.Lock()
+font_versions = {}
+image_lock = threading.Lock()
+stage_timings = {}
+metrics_lock = threading.Lock()
+metrics_local = threading.local()
+
+@contextmanager
+def stage_timer(stage):
+    # Time goes to the stages being collected on this thread, or straight into the rolling windows
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stages = getattr(metrics_local, 'stages', None)
+        if stages is None:
+            add_stage_samples({stage: elapsed})
+        else:
+            stages[stage] = stages.get(stage, 0) + elapsed
+
+@contextmanager
+def collect_stages():
+    outer = getattr(metrics_local, 'stages', None)
+    metrics_local.stages = stages = {}
+    try:
+        yield stages
+    finally:
+        metrics_local.stages = outer
+
+def merge_stages(stages, prefix):
+    # Stages timed on another thread, added to this thread's collection under the prefix
+    prefixed = {f"{prefix}.{stage}": seconds for stage, seconds in stages.items()}
+    outer = getattr(metrics_local, 'stages', None)
+    if outer is None:
+        add_stage_samples(prefixed)
+    else:
+        outer.update(prefixed)
+
+def add_stage_samples(stages):
+    with metrics_lock:
+        for stage, seconds in stages.items():
+            stage_timings.setdefault(stage, deque(maxlen=metrics_window)).append(seconds)
+
+def record_stages(event, stages, **fields):
+    # One structured line per cycle, parse or sink delivery
+    if not stages:
+        return
+    add_stage_samples(stages)
+    logger.info("metrics " + json.dumps({'event': event, **fields,
+                                         'stages': {stage: round(seconds * 1000, 2) for stage, seconds in stages.items()}}))
+    if metrics_file:
+        write_metrics_file()
+
+def percentile(values, percent):
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+def metrics_snapshot():
+    with metrics_lock:
+        samples = {stage: (sorted(timings), timings[-1]) for stage, timings in stage_timings.items()}
+    return {stage: {'count': len(values), 'last_ms': round(last * 1000, 2), 'p50_ms': round(percentile(values, 50) * 1000, 2),
+                    'p95_ms': round(percentile(values, 95) * 1000, 2), 'max_ms': round(values[-1] * 1000, 2)}
+            for stage, (values, last) in samples.items()}
+
+def write_metrics_file():
+    snapshot = {'updated': datetime.now().isoformat(), 'window': metrics_window, 'stages': metrics_snapshot()}
+    temp_path = metrics_file + ".tmp"
+    try:
+        with metrics_lock:
+            with open(temp_path, 'w') as file:
+                json.dump(snapshot, file, indent=2)
+            os.replace(temp_path, metrics_file)
+    except OSError as e:
+        logger.warning(f"Could not write {metrics_file}: {e}")
+
+def is_planner_file(file_name):
+    file_name = os.path.basename(file_name)
+    return file_name.endswith((".xlsx", ".ods")) and not file_name.startswith("~$")
+
+class PlannerChangeHandler(FileSystemEventHandler):
+    def on_any_event(self, event):
+        # Our own reads show up as opened/closed events on some platforms
+        if event.is_directory or event.event_type not in ("created", "modified", "moved", "deleted"):
+            return
+        paths = [event.src_path, getattr(event, 'dest_path', '')]
+        if any(is_planner_file(path) for path in paths if path):
+            directory_changed.set()
+
+class ConfigChangeHandler(FileSystemEventHandler):
+    def on_any_event(self, event):
+        # Editors often save by writing a temporary file and moving it over values.txt
+        paths = [event.src_path, getattr(event, 'dest_path', '')]
+        if any(os.path.abspath(path) == os.path.abspath(config_file) for path in paths if path):
+            directory_changed.set()
+
+def start_watcher(directory):
+    if Observer is None:
+        logger.info(f"watchdog not installed, polling {directory} every {run_frequency} seconds")
+        return False
+    try:
+        observer = Observer()
+        observer.schedule(PlannerChangeHandler(), directory, recursive=False)
+        observer.schedule(ConfigChangeHandler(), os.path.dirname(os.path.abspath(config_file)), recursive=False)
+        observer.daemon = True
+        observer.start()
+    except Exception as e:
+        logger.error(f"Could not watch {directory}: {e}. Falling back to polling")
+        return False
+    logger.info(f"Watching {directory} for planner changes")
+    return True
+
+def wait_for_change(timeout):
+    if not directory_changed.wait(timeout):
+        return False
+    directory_changed.clear()
+    if parse_finished.is_set():
+        # A background parse is ready, planner writes were already settled by the parse job
+        parse_finished.clear()
+        return True
+    # Saving a workbook fires a burst of events, wait for it to go quiet
+    while directory_changed.wait(watch_debounce):
+        directory_changed.clear()
+    return True
+
+def workbook_locked(file_path):
+    # Excel keeps a ~$ owner file next to an open workbook, long names lose their first two characters
+    folder, name = os.path.split(file_path)
+    return any(f.startswith("~$") and f[2:] in (name, name[2:]) for f in os.listdir(folder or "."))
+
+def wait_until_settled(file_path, signature):
+    if time.time() - signature[0] / 1e9 > settle_timeout and not workbook_locked(file_path):
+        return signature
+    deadline = time.time() + settle_timeout
+    quiet = 0
+    while time.time() < deadline:
+        time.sleep(watch_debounce)
+        current = file_signature(file_path)
+        if current != signature:
+            signature, quiet = current, 0
+            continue
+        quiet += 1
+        # A workbook still open in Excel gets one extra quiet interval before parsing
+        if quiet >= (2 if workbook_locked(file_path) else 1):
+            return signature
+    logger.warning(f"{os.path.basename(file_path)} still changing after {settle_timeout} seconds, parsing anyway")
+    return signature
+
+def find_planner_files(directory):
+    # Oldest first, so the newest planner wins wherever planners overlap
+    files = [f for f in os.listdir(directory) if is_planner_file(f)]
+    return sorted(files, key=lambda f: os.path.getmtime(os.path.join(directory, f)))
+
+def planner_title(planner_files):
+    if len(planner_files) > 1:
+        return f"{planner_files[-1]} + {len(planner_files) - 1} more"
+    return planner_files[-1] if planner_files else None
+
+def load_planners(file_paths):
+    global parse_executor
+    if len(file_paths) == 1:
+        return load_schedule(file_paths[0])
+
+    # Each workbook keeps its own cache entry, so only the one that changed is parsed again
+    if parse_executor is None:
+        parse_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="parse")
+    schedules = list(parse_executor.map(load_schedule, file_paths))
+    # A planner that failed is left out until it changes, one still being parsed keeps the last merged board up
+    waiting = any(schedule is None and file_path not in failed_planners for file_path, schedule in zip(file_paths, schedules))
+    if waiting and 'schedule' in merged_cache:
+        return merged_cache['schedule']
+    schedules = [schedule for schedule in schedules if schedule is not None]
+    if not schedules:
+        return None
+    parts = merged_cache.get('parts', [])
+    if len(parts) == len(schedules) and all(a is b for a, b in zip(parts, schedules)):
+        return merged_cache['schedule']
+
+    merged = pd.concat(schedules, ignore_index=True)
+    keys = [col for col in ["IST(+ 5.5)", "CHANNEL", "CIRCUIT"] if col in merged.columns]
+    merged = merged.drop_duplicates(subset=keys, keep='last')
+    logger.info(f"Merged {len(merged)} live events from {len(schedules)} planners")
+    merged_cache['parts'] = schedules
+    merged_cache['schedule'] = merged
+    return merged
+
+class EventStore:
+    # Live events sorted by start time, answering "what is on the board now" and "what changes next" with bisect
+    def __init__(self, schedule):
+        schedule = schedule.dropna(subset=['IST(+ 5.5)', 'End Time']).sort_values('IST(+ 5.5)', kind='stable')
+        self.starts = list(schedule['IST(+ 5.5)'].dt.to_pydatetime())
+        self.expiries = list(schedule['End Time'].dt.to_pydatetime())
+        self.records = schedule.drop(columns=['End Time']).fillna('').to_dict('records')
+        self.max_span = max((end - start for start, end in zip(self.starts, self.expiries)), default=timedelta(0))
+
+        transitions = []
+        for index, (start, expiry) in enumerate(zip(self.starts, self.expiries)):
+            transitions += [
+                (start - timedelta(seconds=upcoming_event_in), index, "upcoming"),
+                (start - timedelta(seconds=audio_before), index, "alarm"),
+                (start - timedelta(minutes=flash_before_minutes), index, "flash"),
+                (start, index, "running"),
+                (expiry - timedelta(minutes=grace_period), index, "finished"),
+                (expiry, index, "expired"),
+            ]
+        transitions.sort(key=lambda transition: transition[0])
+        self.transition_times = [transition[0] for transition in transitions]
+        self.transitions = [(transition[1], transition[2]) for transition in transitions]
+
+    def __len__(self):
+        return len(self.records)
+
+    def visible(self, now, count):
+        # Next events that have not expired, earlier starts can only still be on the board within max_span
+        rows = []
+        for index in range(bisect_left(self.starts, now - self.max_span), len(self.starts)):
+            if self.expiries[index] > now:
+                rows.append(self.records[index])
+                if len(rows) == count:
+                    break
+        return rows
+
+    def starting_between(self, after, until):
+        return self.records[bisect_right(self.starts, after):bisect_right(self.starts, until)]
+
+    def transitions_between(self, after, until):
+        first, last = bisect_right(self.transition_times, after), bisect_right(self.transition_times, until)
+        return [(self.transition_times[i], kind, self.records[index]) for i, (index, kind) in
+                zip(range(first, last), self.transitions[first:last])]
+
+    def next_transition(self, after):
+        index = bisect_right(self.transition_times, after)
+        return self.transition_times[index] if index < len(self.transition_times) else None
+
+def get_event_store(schedule):
+    # Rebuilt only when the schedule cache hands out a new table
+    if event_store_cache.get('schedule') is not schedule:
+        event_store_cache['schedule'] = schedule
+        event_store_cache['store'] = EventStore(schedule)
+    return event_store_cache['store']
+
+def render_due(store):
+    global rendered_store, last_render
+    now = datetime.now()
+    if store is not rendered_store:
+        rendered_store, last_render = store, now
+        return True
+    upcoming = store.next_transition(last_render)
+    if upcoming is None or upcoming > now:
+        return False
+    last_render = now
+    return True
+
+def next_transition_in():
+    upcoming = rendered_store.next_transition(last_render) if rendered_store else None
+    if upcoming is None:
+        return None
+    return max(0, (upcoming - datetime.now()).total_seconds())
+
+def reload_config():
+    # values.txt is parsed again only when it changed, then each change invalidates just what depends on it
+    global config_signature, render_target_list, render_pool, rendered_store
+    try:
+        signature = file_signature(config_file)
+    except OSError:
+        return False
+    if signature == config_signature:
+        return False
+    config_signature = signature
+    settings = load_config(config_file, {name: globals()[name] for name, *_ in config_schema.values()})
+    changed = {name: value for name, value in settings.items() if globals()[name] != value}
+    if not changed:
+        return False
+    globals().update(changed)
+    logger.info(f"{config_file} changed: {', '.join(f'{name}={value}' for name, value in changed.items())}")
+
+    effects = {name: effect for name, kind, default, effect in config_schema.values() if name in changed}
+    restart = [name for name, effect in effects.items() if effect == 'restart']
+    if restart:
+        logger.warning(f"Restart to apply {', '.join(restart)}")
+    if 'parse' in effects.values():
+        # Stale signatures make every planner parse again while its current table stays on the board
+        for cached in schedule_cache.values():
+            cached['signature'] = cached['digest'] = None
+        failed_planners.clear()
+        merged_cache.clear()
+    if 'targets' in effects.values():
+        render_target_list = None
+        base_layer_cache.clear()
+        frame_cache.clear()
+        shown_page.clear()
+        if render_pool is not None:
+            render_pool.shutdown(wait=False)
+            render_pool = None
+    if 'store' in effects.values():
+        event_store_cache.clear()
+    if 'metrics' in effects.values():
+        with metrics_lock:
+            for stage, timings in stage_timings.items():
+                stage_timings[stage] = deque(timings, maxlen=metrics_window)
+    if {'render', 'targets', 'store'} & set(effects.values()):
+        rendered_store = None
+    return True
 
 def monitor_directory(directory):
-    #last_processed_file = None
+    global latest_file, rendered_store
+    watching = start_watcher(directory)
+    rescan = True
+    planner_files = []
 
     while True:
+        failed = False
+        with collect_stages() as stages, stage_timer("cycle"):
+            try:
+                # merge_workbooks may have changed, so the directory is listed again after a config change
+                if reload_config():
+                    rescan = True
+                # With a watcher the directory is only listed again after a change event
+                if rescan or not watching:
+                    planner_files = find_planner_files(directory)
+                    if not merge_workbooks:
+                        planner_files = planner_files[-1:]
+                file_paths = [os.path.join(directory, f) for f in planner_files]
+                with stage_timer("load_planners"):
+                    schedule = load_planners(file_paths) if planner_files else None
+                if not planner_files:
+                    #print("No Excel or ODS files found. Waiting...")
+                    logger.error("No Excel or ODS files found. Waiting...")
+                elif schedule is None and rendered_store is None:
+                    logger.info(f"Waiting for {planner_title(planner_files)} to be parsed")
+                else:
+                    # Until a new planner is parsed the previous board stays up, title included
+                    if schedule is not None:
+                        store = get_event_store(schedule)
+                        latest_file = planner_title(planner_files)
+                    else:
+                        store = rendered_store
+                    if render_due(store):
+                        logger.info(f"using {latest_file} from {', '.join(file_paths)}")
+
+                        
+                        logger.info(f"Processing: {latest_file}")
+                        with stage_timer("render_board"):
+                            frames = render_board(store)  # Process the file
+                    else:
+                        frames = rotate_page()
+
+                    with stage_timer("dispatch"):
+                        for frame in frames:
+                            dispatch_frame(frame)  # Hand the frame to the wallpaper and other sinks
+
+            except Exception as e:
+                logger.error(f"Error: {e}. Retrying in {run_frequency} seconds...")
+                rendered_store = None
+                failed = True
+        if "render_board" in stages:
+            record_stages("cycle", stages, rows=display_rows)
+
+        # Sleep until the next row changes state, the planner changes or a retry is due
+        timeout = min((wait for wait in (next_transition_in(), next_rotation_in()) if wait is not None), default=None)
+        if failed or not watching:
+            timeout = run_frequency if timeout is None else min(timeout, run_frequency)
+        rescan = wait_for_change(timeout) or failed
+
+def file_digest(file_path):
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_schedule(file_path):
+    # Parsed PLANNER sheet is reused until the workbook changes on disk
+    signature = file_signature(file_path)
+    cached = schedule_cache.get(file_path)
+    if cached and cached['signature'] == signature:
+        return cached['schedule']
+    # A workbook that failed to parse is tried again only once it changes on disk
+    if failed_planners.get(file_path) == signature:
+        return cached['schedule'] if cached else None
+
+    with stage_timer("load_snapshot"):
+        snapshot = load_snapshot(file_path, signature) if cached is None else None
+    if snapshot is not None:
+        schedule_cache[file_path] = snapshot
+        return snapshot['schedule']
+
+    if ingest_workers > 0:
+        future = submit_parse(file_path, signature)
+        # The board keeps showing the last good schedule while the new one is parsed, None until there is one
+        if future is None or not future.done():
+            return cached['schedule'] if cached else None
+        with ingest_lock:
+            if ingest_jobs.get(file_path, {}).get('future') is future:
+                del ingest_jobs[file_path]
+        # Each planner's job fails on its own, the other planners' jobs keep going
+        error = future.exception()
+        if error is not None:
+            return parse_failed(file_path, signature, cached, error)
+        parsed = dict(future.result())
+    else:
         try:
-            files = [f for f in os.listdir(directory) if f.endswith((".xlsx", ".ods"))]
-            if not files:
-                #print("No Excel or ODS files found. Waiting...")
-                logger.error("No Excel or ODS files found. Waiting...")
+            parsed = dict(parse_workbook(file_path, signature))
+        except Exception as e:
+            return parse_failed(file_path, signature, cached, e)
+    failed_planners.pop(file_path, None)
+    record_stages("parse", parsed.pop('stages'), file=os.path.basename(file_path))
+
+    if cached and parsed['digest'] and cached['digest'] == parsed['digest']:
+        logger.info(f"{os.path.basename(file_path)} touched but content unchanged, reusing parsed schedule")
+        cached['signature'] = parsed['signature']
+        return cached['schedule']
+
+    schedule_cache[file_path] = parsed
+    logger.info(f"Parsed {len(parsed['schedule'])} live events from {os.path.basename(file_path)}")
+    with stage_timer("save_snapshot"):
+        save_snapshot(file_path, parsed)
+    return parsed['schedule']
+
+def parse_failed(file_path, signature, cached, error):
+    failed_planners[file_path] = signature
+    logger.error(f"Could not parse {os.path.basename(file_path)} ({error}), skipping it until it changes")
+    return cached['schedule'] if cached else None
+
+def parse_settings():
+    return {name: globals()[name] for name in parse_setting_names}
+
+def parse_workbook(file_path, signature, settings=None):
+    # Runs in the ingestion pool, settling included, so a slow or busy workbook never stalls the render loop.
+    # Stage timings travel back with the result, the pool process has no metrics of its own.
+    if settings:
+        globals().update(settings)
+    with collect_stages() as stages, stage_timer("parse"):
+        with stage_timer("settle"):
+            signature = wait_until_settled(file_path, signature)
+        with stage_timer("file_digest"):
+            digest = file_digest(file_path) if cache_hash else None
+        schedule = parse_schedule(file_path)
+    return {'signature': signature, 'digest': digest, 'schedule': schedule, 'stages': stages}
+
+def wake_after_parse(future):
+    parse_finished.set()
+    directory_changed.set()
+
+def init_parse_worker(log_queue):
+    # Only the board process writes live.log, so its rollover never finds the file held open by a worker
+    for worker_handler in list(logger.handlers):
+        logger.removeHandler(worker_handler)
+        worker_handler.close()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+
+def submit_parse(file_path, signature):
+    global ingest_pool
+    # Planners in merge mode are loaded from several threads, they share one pool and one job table
+    with ingest_lock:
+        job = ingest_jobs.get(file_path)
+        settings = parse_settings()
+        if job and job['signature'] == signature and job['settings'] == settings:
+            return job['future']
+        if job and not job['future'].done():
+            # Superseded by a newer save, a job that already started is left to finish and ignored
+            job['future'].cancel()
+            logger.info(f"Dropping parse of older {os.path.basename(file_path)}")
+            del ingest_jobs[file_path]
+
+        pending = sum(1 for job in ingest_jobs.values() if not job['future'].done())
+        if pending >= ingest_queue_size:
+            logger.warning(f"{pending} planners already queued, {os.path.basename(file_path)} will be parsed later")
+            return None
+
+        if ingest_pool is None:
+            log_queue = multiprocessing.Queue()
+            logging.handlers.QueueListener(log_queue, handler, console_handler).start()
+            ingest_pool = ProcessPoolExecutor(max_workers=ingest_workers, initializer=init_parse_worker, initargs=(log_queue,))
+        future = ingest_pool.submit(parse_workbook, file_path, signature, settings)
+        future.add_done_callback(wake_after_parse)
+        ingest_jobs[file_path] = {'signature': signature, 'settings': settings, 'future': future}
+        logger.info(f"Queued {os.path.basename(file_path)} for parsing")
+        return future
+
+def snapshot_path(file_path):
+    return file_path + ".schedule.json"
+
+def snapshot_tag(signature):
+    # Anything that changes the parsed table has to be part of the tag
+    return {'version': 3, 'signature': list(signature), 'grace_period': grace_period, 'skip_rows': skip_rows}
+
+def load_snapshot(file_path, signature):
+    # Normalized table saved by an earlier run, valid while the workbook is untouched
+    if not schedule_snapshot or not os.path.exists(snapshot_path(file_path)):
+        return None
+    try:
+        with open(snapshot_path(file_path), encoding='utf-8') as file:
+            snapshot = json.load(file)
+        if snapshot.get('tag') != snapshot_tag(signature):
+            return None
+        schedule = pd.DataFrame({name: pd.to_datetime(column['datetime_ns'], unit='ns') if 'datetime_ns' in column else column['values']
+                                 for name, column in snapshot['columns'].items()})
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable snapshot {snapshot_path(file_path)}: {e}")
+        return None
+    logger.info(f"Loaded {len(schedule)} live events from snapshot of {os.path.basename(file_path)}")
+    return {'signature': signature, 'digest': snapshot.get('digest'), 'schedule': schedule}
+
+def save_snapshot(file_path, cached):
+    # Plain JSON, one list per column and datetimes as epoch nanoseconds, so a snapshot can only ever be data
+    if not schedule_snapshot:
+        return
+    temp_path = snapshot_path(file_path) + ".tmp"
+    try:
+        columns = {}
+        for name, column in cached['schedule'].items():
+            if pd.api.types.is_datetime64_any_dtype(column):
+                columns[name] = {'datetime_ns': column.to_numpy(dtype='datetime64[ns]').astype('int64').tolist()}
             else:
-                global latest_file
-                latest_file = max(files, key=lambda f: os.path.getmtime(os.path.join(directory, f)))
-                file_path = os.path.join(directory, latest_file)
-                logger.info(f"using {latest_file} from {file_path}")
+                columns[name] = {'values': column.tolist()}
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump({'tag': snapshot_tag(cached['signature']), 'digest': cached['digest'], 'columns': columns}, file)
+        os.replace(temp_path, snapshot_path(file_path))
+    except (OSError, TypeError, ValueError) as e:
+        # Cells JSON cannot hold, such as times of day from read_excel, only cost the snapshot
+        logger.warning(f"Could not write snapshot for {os.path.basename(file_path)}: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
 
-                
-                logger.info(f"Processing: {latest_file}")
-                process_file(file_path)  # Process the file
+def parse_schedule(file_path):
+    if file_path.lower().endswith(".xlsx"):
+        try:
+            return read_planner_xlsx(file_path)
+        except (KeyError, ValueError, zipfile.BadZipFile) as e:
+            logger.warning(f"Streaming reader failed on {os.path.basename(file_path)} ({e}), falling back to read_excel")
+    return read_planner_frame(file_path)
 
-                image_path = os.path.join(directory, "output_image.png")
-                set_as_wallpaper(image_path)  # Set the wallpaper
+spreadsheet_ns = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+relationship_ns = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
 
-                #last_processed_file = latest_file  # Mark as processed
+def column_index(reference):
+    index = 0
+    for char in reference:
+        if not char.isalpha():
+            break
+        index = index * 26 + ord(char.upper()) - 64
+    return index - 1
 
-        except Exception as e:
-            logger.error(f"Error: {e}. Retrying in {run_frequency} seconds...")
-
-        time.sleep(run_frequency) 
-def process_file(file_path):
-    required_columns = {
-        "IST(+ 5.5)": "IST(+ 5.5)",
-        "DUR": "DUR",
-        "TELECAST": "TELECAST",
-        "DESCRIPTION": "DESCRIPTION",
-        "CHANNEL": "CHANNEL",
-        "LINE INPUT": "LINE INPUT",
-        "SOURCE": "SOURCE",
-        "CIRCUIT": "CIRCUIT"
-    }
-
-    df = pd.read_excel(file_path, sheet_name="PLANNER", skiprows=2)
-
-    if "CHANNEL" in df.columns:
-        channel_index = df.columns.get_loc("CHANNEL")
-        potential_split_columns = [col for col in df.columns[channel_index + 1:] if "Unnamed:" in str(col)]
-
-        if potential_split_columns:
-            for split_col in potential_split_columns:
-                df["CHANNEL"] = df.apply(
-                    lambda row: str(row["CHANNEL"]) + " " + str(row[split_col]) if pd.notna(row[split_col]) else str(row["CHANNEL"]),
-                    axis=1
-                )
-                df = df.drop(columns=[split_col])
-
-    selected_columns = [col for col in required_columns.keys() if col in df.columns]
-    df = df[selected_columns]
-
-    if "TELECAST" in df.columns:
-        df = df[df["TELECAST"].str.contains("live", case=False, na=False)]
-
-    df['IST(+ 5.5)'] = pd.to_datetime(df['IST(+ 5.5)'], errors='coerce')
-
-    df['End Time'] = df.apply(
-        lambda row: row['IST(+ 5.5)'] + timedelta(hours=int(row['DUR']), minutes=(row['DUR'] % 1) * 60) + timedelta(minutes=grace_period)
-        if pd.notna(row['IST(+ 5.5)']) and pd.notna(row['DUR'])
-        else None, axis=1
-    )
+def excel_datetime(serial, date1904):
+    epoch = datetime(1904, 1, 1) if date1904 else datetime(1899, 12, 30)
+    return epoch + timedelta(milliseconds=round(serial * 86400000))
 
-    now = datetime.now()
+def xlsx_parts(archive, sheet_name):
+    workbook = fromstring(archive.read("xl/workbook.xml"))
+    properties = workbook.find(spreadsheet_ns + "workbookPr")
+    date1904 = properties is not None and properties.get("date1904") in ("1", "true")
+    relations = fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+    targets = {}
+    for relation in relations:
+        target = relation.get("Target")
+        target = target[1:] if target.startswith("/") else "xl/" + target
+        targets[relation.get("Id")] = target
+        if relation.get("Type", "").endswith("/sharedStrings"):
+            targets["sharedStrings"] = target
+    for sheet in workbook.iter(spreadsheet_ns + "sheet"):
+        if sheet.get("name") == sheet_name:
+            return targets[sheet.get(relationship_ns + "id")], targets.get("sharedStrings"), date1904
+    raise KeyError(f"Worksheet named '{sheet_name}' not found")
 
-    df = df[df['End Time'] > now]
+def xlsx_shared_strings(archive, path):
+    strings = []
+    if path is None:
+        return strings
+    with archive.open(path) as file:
+        for _, element in iterparse(file):
+            if element.tag == spreadsheet_ns + "si":
+                # Plain text or rich text runs, phonetic hints are left out
+                text = element.findtext(spreadsheet_ns + "t")
+                if text is None:
+                    text = "".join(run.findtext(spreadsheet_ns + "t") or "" for run in element.iter(spreadsheet_ns + "r"))
+                strings.append(text)
+                element.clear()
+    return strings
 
-    # Drop temporary end time column
-    df = df.drop(columns=['End Time'])
+def xlsx_cell_value(cell, strings):
+    cell_type = cell.get("t", "n")
+    if cell_type == "inlineStr":
+        return "".join(text.text or "" for text in cell.iter(spreadsheet_ns + "t"))
+    value = cell.findtext(spreadsheet_ns + "v")
+    if value is None or cell_type == "e":
+        return None
+    if cell_type == "s":
+        return strings[int(value)]
+    if cell_type in ("str", "d"):
+        return value
+    if cell_type == "b":
+        return value == "1"
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
 
-    # Replace NaN with empty string in all columns
-    df.fillna('', inplace=True)
+def iter_xlsx_rows(file_path, sheet_name, header_row, wanted):
+    # Yields (row number, {column index: value}), decoding every cell up to the header row and only wanted columns after it
+    with zipfile.ZipFile(file_path) as archive:
+        sheet_path, strings_path, date1904 = xlsx_parts(archive, sheet_name)
+        strings = xlsx_shared_strings(archive, strings_path)
+        yield 0, date1904
+        with archive.open(sheet_path) as file:
+            row_number = 0
+            for _, element in iterparse(file):
+                if element.tag != spreadsheet_ns + "row":
+                    continue
+                row_number = int(element.get("r", row_number + 1))
+                values = {}
+                index = -1
+                for cell in element.iter(spreadsheet_ns + "c"):
+                    reference = cell.get("r")
+                    index = column_index(reference) if reference else index + 1
+                    if row_number <= header_row or index in wanted:
+                        values[index] = xlsx_cell_value(cell, strings)
+                element.clear()
+                yield row_number, values
 
-    # Generate image from data
-    create_image(df)
+def read_planner_xlsx(file_path):
+    # Streams the PLANNER sheet XML, keeping only live events that have not finished yet.
+    # Styles are never loaded, they dominate openpyxl's load time on the planner workbooks.
+    header_row = skip_rows + 1  # Same header row as read_excel(skiprows=skip_rows)
+    wanted = set()
+    # Reading, the live/finished filters and the channel merge all happen in this one streaming pass
+    with stage_timer("read_xlsx"):
+        rows = iter_xlsx_rows(file_path, "PLANNER", header_row, wanted)
+        date1904 = next(rows)[1]
+
+        header = {}
+        for row_number, values in rows:
+            if row_number == header_row:
+                header = values
+                break
+        names = [header.get(i) for i in range(max(header, default=-1) + 1)]
+        columns = {name: names.index(name) for name in required_columns if name in names}
+        split_columns = []
+        if "CHANNEL" in columns:
+            split_columns = [i for i in range(columns["CHANNEL"] + 1, len(names)) if names[i] in (None, "")]
+        wanted.update(columns.values(), split_columns)
+
+        now = datetime.now()
+        grace = timedelta(minutes=grace_period)
+        records = []
+        for row_number, values in rows:
+            if "TELECAST" in columns:
+                telecast = values.get(columns["TELECAST"])
+                if not isinstance(telecast, str) or "live" not in telecast.lower():
+                    continue
+
+            start = values.get(columns.get("IST(+ 5.5)"))
+            try:
+                if isinstance(start, (int, float)) and not isinstance(start, bool):
+                    start = excel_datetime(start, date1904)
+                elif start is not None:
+                    start = pd.Timestamp(start).to_pydatetime()
+                duration = float(values.get(columns.get("DUR")))
+            except (TypeError, ValueError):
+                continue
+            if start is None or pd.isna(start) or duration != duration:
+                continue
+            end_time = start + timedelta(hours=duration) + grace
+            if end_time <= now:
+                continue
+
+            record = {name: values.get(index) for name, index in columns.items()}
+            record["IST(+ 5.5)"] = start
+            record["DUR"] = duration
+            if split_columns:
+                channel = "" if record["CHANNEL"] is None else str(record["CHANNEL"])
+                for index in split_columns:
+                    if values.get(index) is not None:
+                        channel += " " + str(values[index])
+                record["CHANNEL"] = channel.strip()
+            record["End Time"] = end_time
+            records.append(record)
+
+    with stage_timer("build_frame"):
+        df = pd.DataFrame(records, columns=list(columns) + ["End Time"])
+        df['IST(+ 5.5)'] = pd.to_datetime(df['IST(+ 5.5)'])
+        df['End Time'] = pd.to_datetime(df['End Time'])
+    return df
+
+def read_planner_frame(file_path):
+    with stage_timer("read_excel"):
+        df = pd.read_excel(file_path, sheet_name="PLANNER", skiprows=skip_rows)
+
+    with stage_timer("merge_channels"):
+        df = merge_channel_columns(df)
+
+    with stage_timer("filter"):
+        selected_columns = [col for col in required_columns if col in df.columns]
+        df = df[selected_columns]
+
+        if "TELECAST" in df.columns:
+            df = df[df["TELECAST"].str.contains("live", case=False, na=False)]
+
+    with stage_timer("end_time"):
+        df['IST(+ 5.5)'] = pd.to_datetime(df['IST(+ 5.5)'], errors='coerce')
+
+        df['End Time'] = compute_end_time(df)
 
     return df
 
-def wrap_text(draw, text, font, max_width):
-    words = text.split()
+def merge_channel_columns(df):
+    # Merged CHANNEL cells spill into unnamed columns to their right
+    if "CHANNEL" not in df.columns:
+        return df
+    channel_index = df.columns.get_loc("CHANNEL")
+    split_columns = [col for col in df.columns[channel_index + 1:] if "Unnamed:" in str(col)]
+    if not split_columns:
+        return df
+
+    channel = df["CHANNEL"].fillna("").astype(str)
+    for split_col in split_columns:
+        split = df[split_col]
+        has_split = split.notna()
+        channel = channel.mask(has_split, channel + " " + split.astype(str))
+    df = df.drop(columns=split_columns)
+    df["CHANNEL"] = channel.str.strip()
+    return df
+
+def compute_end_time(df):
+    duration = pd.to_timedelta(pd.to_numeric(df['DUR'], errors='coerce'), unit='h')
+    return df['IST(+ 5.5)'] + duration + pd.Timedelta(minutes=grace_period)
+
+def process_file(*file_paths):
+    schedule = load_planners(list(file_paths))
+    if schedule is None:
+        return None
+    return render_board(get_event_store(schedule))
+
+def render_board(store):
+    # Frames for every render target whose picture changed
+    now = datetime.now()
+
+    if audio_alarm:
+        for row in store.starting_between(now, now + timedelta(seconds=audio_before)):
+            queue_alarm(row)
+
+    with stage_timer("visible_rows"):
+        rows = store.visible(now, display_rows * max(1, max_pages) if page_interval else display_rows)
+
+    targets = get_render_targets()
+    fit_wrap_cache(len(rows) * len(required_columns) * len(targets))
+    if len(targets) == 1:
+        frames = [create_image(rows)]
+    else:
+        # Targets share the parsed rows and the text caches but nothing else, so they render side by side
+        global render_pool
+        if render_pool is None:
+            render_pool = ThreadPoolExecutor(max_workers=len(targets))
+        frames = []
+        for target, (frame, stages) in zip(targets, render_pool.map(lambda target: render_target(rows, target), targets)):
+            merge_stages(stages, target['name'])
+            frames.append(frame)
+    return [frame for frame in frames if frame]
+
+def render_target(rows, target):
+    with collect_stages() as stages:
+        frame = create_image(rows, target)
+    return frame, stages
+
+def measure_text(font, text):
+    # Bounding box and advance width per (font, size, text), cell values repeat across rows and cycles
+    key = (font.path, font.size, text)
+    with wrap_lock:
+        measured = text_measure_cache.get(key)
+    if measured is None:
+        measured = (font.getbbox(text), font.getlength(text))
+        with wrap_lock:
+            if len(text_measure_cache) > 50000:
+                text_measure_cache.clear()
+            text_measure_cache[key] = measured
+    return measured
+
+def fit_wrap_cache(cells):
+    # Room for every cell a render wraps, or the LRU evicts entries the next render needs again
+    global wrap_cache_size
+    wrap_cache_size = max(wrap_cache_size, cells)
+
+def wrap_text(text, font, max_width):
+    key = (text, font.path, font.size, max_width)
+    with wrap_lock:
+        lines = wrap_cache.get(key)
+        if lines is not None:
+            wrap_cache.move_to_end(key)
+            return lines
+
+    space_width = measure_text(font, " ")[1]
     lines = []
-    current_line = ""
-    for word in words:
-        bbox = draw.textbbox((0, 0), current_line + " " + word, font=font)
-        if bbox[2] <= max_width:
-            current_line += (" " if current_line else "") + word
+    current_line = []
+    current_width = 0
+    for word in text.split():
+        word_width = measure_text(font, word)[1]
+        line_width = current_width + space_width + word_width if current_line else word_width
+        if line_width <= max_width or not current_line:
+            current_line.append(word)
+            current_width = line_width
         else:
-            lines.append(current_line)
-            current_line = word
-    lines.append(current_line)
+            lines.append(" ".join(current_line))
+            current_line = [word]
+            current_width = word_width
+    lines.append(" ".join(current_line))
+
+    lines = tuple(lines)
+    with wrap_lock:
+        wrap_cache[key] = lines
+        if len(wrap_cache) > wrap_cache_size:
+            wrap_cache.popitem(last=False)
     return lines
 
-def create_image(df):
-    background_path = get_resource_path('background.jfif')
-    logo_path = get_resource_path('logo.jfif')
+def get_asset(name, fallback, loader, *args):
+    # Decoded once and shared, the file is looked at again only every asset_check_interval seconds
+    # and loaded again only when it was replaced or its mtime changed
+    key = (name, loader) + args
+    now = time.monotonic()
+    with asset_lock:
+        entry = asset_cache.get(key)
+        if entry and now - entry['checked'] < asset_check_interval:
+            return entry['value'], entry['version']
+        path = get_resource_path(name)
+        if fallback and not os.path.exists(path):
+            path = fallback
+        # A font missing here is found by truetype in the system font folder, that copy is not watched
+        version = (path, os.path.getmtime(path) if os.path.exists(path) else None)
+        if entry is None or entry['version'] != version:
+            logger.info(f"{'Reloading' if entry else 'Loading'} {os.path.basename(path)}{' at ' + str(args[0]) if args else ''}")
+            entry = asset_cache[key] = {'value': loader(path, *args), 'version': version}
+        entry['checked'] = now
+        return entry['value'], entry['version']
+
+def open_rgba(path):
+    return Image.open(path).convert('RGBA')
+
+def load_font(path, size):
+    try:
+        return ImageFont.truetype(path, size)
+    except OSError as e:
+        logger.warning(f"Could not load {os.path.basename(path)} ({e}), using Pillow's default font")
+        return ImageFont.load_default(size)
+
+def get_font(size):
+    font, version = get_asset("arialbd.ttf", None, load_font, size)
+    # Measured and wrapped text is only valid for the font file it was measured with
+    if font_versions.setdefault(size, version) != version:
+        font_versions[size] = version
+        with wrap_lock:
+            wrap_cache.clear()
+            text_measure_cache.clear()
+    return font
+
+def get_background():
+    return get_asset('background.jfif', 'default_background.jfif', open_rgba)
+
+def get_logo():
+    return get_asset('logo.jfif', 'default_logo.png', open_rgba)
+
+def preload_assets():
+    # Fonts at every size the targets use, background and logo, so the first render does no loading
+    try:
+        for target in get_render_targets():
+            get_font(round(font_size * target['scale']))
+            get_font(round(40 * target['scale']))
+        get_background()
+        get_logo()
+    except OSError as e:
+        logger.error(f"Could not preload assets: {e}")
+
+def get_base_layer(cache, screen_width, screen_height, font, headers, column_widths, x_start, y_start, row_height):
+    # Blurred background, logo and header band only change with the assets or the layout
+    background, background_version = get_background()
+    logo, logo_version = get_logo()
+
+    key = (screen_width, screen_height, background_version, logo_version,
+           font, tuple(headers), tuple(column_widths), x_start, y_start, row_height)
+    if cache.get('key') != key:
+        background = background.resize((screen_width, screen_height)).filter(ImageFilter.GaussianBlur(5))
+        image = Image.new('RGBA', background.size)
+        image.paste(background, (0, 0))
+
+        logo_size = (int(image.width * 0.05), int(image.width * 0.05))
+        logo = logo.resize(logo_size)
+        image.paste(logo, (0, 0), logo)
+        draw = ImageDraw.Draw(image)
 
-    if not os.path.exists(background_path):
-        background_path = 'default_background.jfif'
-    if not os.path.exists(logo_path):
-        logo_path = 'default_logo.png'
+        for i, header in enumerate(headers):
+            x_position = x_start + sum(column_widths[:i])
+            draw.rectangle([(x_position, y_start), (x_position + column_widths[i], y_start + row_height)], fill="black")
+            draw.text((x_position + row_height // 5, y_start + row_height // 5), header, font=font, fill="white")
 
-    background = Image.open(background_path).convert('RGBA')
-    logo = Image.open(logo_path).convert('RGBA')
+        cache['key'] = key
+        cache['image'] = image
+        logger.info(f"Built static layer for {screen_width}X{screen_height}")
+    return cache['image']
 
+def probe_screen_size():
+    if sys.platform == "win32":
+        # Plain system metric query, no window needed
+        user32 = ctypes.windll.user32
+        return user32.GetSystemMetrics(0), user32.GetSystemMetrics(1)
     root = tk.Tk()
-    screen_width = root.winfo_screenwidth()
-    screen_height = root.winfo_screenheight()
-    logger.info(f"{screen_width}X{screen_height}")
-    root.destroy()
-
-    background = background.resize((screen_width, screen_height)).filter(ImageFilter.GaussianBlur(5))
-    image = Image.new('RGBA', background.size)
-    image.paste(background, (0, 0))
-
-    logo_size = (int(image.width * 0.05), int(image.width * 0.05))
-    logo = logo.resize(logo_size)
-    image.paste(logo, (0, 0), logo)
-    draw = ImageDraw.Draw(image)
-    
-    
-    
-    font = ImageFont.truetype(get_resource_path("arialbd.ttf"), font_size)
-    file_name_x = screen_width // 2.2 - (draw.textbbox((0, 0), latest_file, font=font)[2] // 2)
-    font_filename = ImageFont.truetype(get_resource_path("arialbd.ttf"), 40)
+    try:
+        return root.winfo_screenwidth(), root.winfo_screenheight()
+    finally:
+        root.destroy()
+
+def get_screen_size():
+    global screen_size
+    if configured_width and configured_height:
+        return configured_width, configured_height
+    # Windows metrics are cheap enough to follow resolution changes, elsewhere the display is probed once
+    if screen_size is None or sys.platform == "win32":
+        try:
+            current = probe_screen_size()
+        except Exception as e:
+            if screen_size is None:
+                raise RuntimeError(f"Cannot read screen size ({e}), set width and height in values.txt")
+            current = screen_size
+        if current != screen_size:
+            logger.info(f"{current[0]}X{current[1]}")
+            screen_size = current
+    return screen_size
+
+def new_target(name, size, path, sinks, scale, image_format):
+    return {'name': name, 'size': size, 'path': path, 'sinks': sinks, 'scale': scale, 'format': image_format,
+            'base_layer': {}, 'frames': {}, 'shown': {}}
 
-    draw.text((file_name_x, 30), latest_file, font=font_filename, fill="white")
-    y_start, x_start, row_height = 100, 0, 50
-    column_widths = [int(screen_width * 0.15625), int(screen_width * 0.05208), int(screen_width * 0.1302), int(screen_width * 0.24218), int(screen_width * 0.10416), int(screen_width * 0.10416), int(screen_width * 0.10416), int(screen_width * 0.10416)]
+def parse_render_targets(spec):
+    # WIDTHxHEIGHT[:path[:sink+sink]] separated by commas, e.g. 1920x1080:output_image.png,3840x2160:wall_4k.png
+    targets = []
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        match = re.match(r'^(\d+)x(\d+)(?::(.+?))?(?::([a-z_+]+))?$', item)
+        if not match:
+            logger.error(f"Ignoring render target {item}, expected WIDTHxHEIGHT:path")
+            continue
+        width, height, path, sinks = match.groups()
+        path = path or f"output_{width}x{height}.{output_format}"
+        name, extension = os.path.splitext(os.path.basename(path))
+        image_format = extension[1:].lower().replace('jpeg', 'jpg')
+        # Fonts, rows and margins were laid out for 1080 lines
+        targets.append(new_target(name, (int(width), int(height)), path, sinks.split('+') if sinks else None, int(height) / 1080,
+                                  image_format if image_format in ("png", "jpg", "bmp") else output_format))
+    return targets
+
+def get_render_targets():
+    # The first target is the board: it uses the module caches, the wallpaper, window and HTTP server and the output_sinks.
+    # Further targets only go to their own file unless they name sinks.
+    global render_target_list
+    if render_target_list is None:
+        render_target_list = parse_render_targets(render_targets) or [new_target("output_image", None, None, None, 1, output_format)]
+        # The board is encoded as output_format, its file takes that extension whatever render_targets called it
+        board = render_target_list[0]
+        root, extension = os.path.splitext(board['path'] or "")
+        if board['path'] and extension[1:].lower().replace('jpeg', 'jpg') != output_format:
+            path = root + "." + output_format
+            logger.error(f"{board['path']} does not match output_format={output_format}, writing the board to {path}")
+            board['path'] = path
+        board.update(base_layer=base_layer_cache, frames=frame_cache, shown=shown_page, format=output_format)
+        for target in render_target_list[1:]:
+            target['sinks'] = target['sinks'] or ["file"]
+        logger.info(f"Render targets: {', '.join(target['name'] for target in render_target_list)}")
+    return render_target_list
+
+def draw_row(draw, model, y_position, font, column_widths, x_start, row_height):
+    wrapped_texts, fill_color, max_lines = model
+    for col_idx in range(len(column_widths)):
+        x_position = x_start + sum(column_widths[:col_idx])
+        draw.rectangle([(x_position, y_position), (x_position + column_widths[col_idx], y_position + row_height * max_lines)],
+                        outline="black", fill=fill_color)
+
+        for line_num, line in enumerate(wrapped_texts[col_idx]):
+            left, top, right, bottom = measure_text(font, line)[0]
+            text_width = right - left
+            text_height = bottom - top
+            x_text = x_position + (column_widths[col_idx] - text_width) // 2
+            y_text = y_position + (row_height * max_lines - text_height) // 2 + line_num * (row_height * 3 // 5)
+            draw.text((x_text, y_text), line, font=font, fill="black")
+
+def create_image(rows, target=None):
+    target = target or get_render_targets()[0]
+    with stage_timer("screen_size"):
+        screen_width, screen_height = target['size'] or get_screen_size()
+
+    scale = target['scale']
+    font = get_font(round(font_size * scale))
+    y_start, x_start, row_height = round(100 * scale), 0, round(50 * scale)
+    column_widths = [int(screen_width * fraction) for fraction in column_fractions]
     headers = ["IST(+ 5.5)", "DUR", "TELECAST", "DESCRIPTION", "CHANNEL", "LINE INPUT", "SOURCE", "CIRCUIT"]
     logger.info(f"using headers {headers}")
 
-    for i, header in enumerate(headers):
-        x_position = x_start + sum(column_widths[:i])
-        draw.rectangle([(x_position, y_start), (x_position + column_widths[i], y_start + row_height)], fill="black")
-        draw.text((x_position + 10, y_start + 10), header, font=font, fill="white")
+    with stage_timer("base_layer"):
+        base = get_base_layer(target['base_layer'], screen_width, screen_height, font, headers, column_widths, x_start, y_start, row_height)
 
-    y_position = y_start + row_height
+    models = []
+    starts = []
+    board_events = []
     now = datetime.now()
 
-    for row_idx, row in df.head(display_rows).iterrows():
-        max_lines = 1
-        wrapped_texts = []
-        for col_idx, header in enumerate(headers):
-            cell_text = str(row[header])
-            wrapped_text = wrap_text(draw, cell_text, font, column_widths[col_idx] - 20)
-            wrapped_texts.append(wrapped_text)
-            max_lines = max(max_lines, len(wrapped_text))
-
-        is_running = False
-        yet_to_start = False
-        finished = False
-        start_time = None
-        duration_str = None
-        upcoming_timer = False  
-        now = datetime.now()
-        
-        if "IST(+ 5.5)" in row and "DUR" in row:
-
-            start_time = row["IST(+ 5.5)"]
-            duration_str = row["DUR"]
-
-        if isinstance(duration_str, (float, int)) and isinstance(start_time, datetime):
-            duration = timedelta(hours=duration_str) 
-            end_time = start_time + duration
-            if start_time <= now <= end_time:
-                is_running = True
-            elif now < start_time:
-                yet_to_start = True
-                if 0 <= (start_time - now).total_seconds() <= upcoming_event_in:
-                    upcoming_timer = True   
-                if 0 <= (start_time - now).total_seconds() <= audio_before:
-                    if audio_alarm:
-                        print(f"Audio Alarm: {audio_alarm} (Type: {type(audio_alarm)})")
-                        play_audio()
-            elif end_time < now:
-                finished = True
-                
-           
-
-        for col_idx, header in enumerate(headers):
-            x_position = x_start + sum(column_widths[:col_idx])
+    with stage_timer("layout"):
+        for row in rows:
+            max_lines = 1
+            wrapped_texts = []
+            for col_idx, header in enumerate(headers):
+                cell_text = str(row[header])
+                wrapped_text = wrap_text(cell_text, font, column_widths[col_idx] - round(20 * scale))
+                wrapped_texts.append(wrapped_text)
+                max_lines = max(max_lines, len(wrapped_text))
+
+            is_running = False
+            yet_to_start = False
+            finished = False
+            start_time = None
+            duration_str = None
+            upcoming_timer = False  
+            now = datetime.now()
+            
+            if "IST(+ 5.5)" in row and "DUR" in row:
+
+                start_time = row["IST(+ 5.5)"]
+                duration_str = row["DUR"]
+
+            if isinstance(duration_str, (float, int)) and isinstance(start_time, datetime):
+                duration = timedelta(hours=duration_str) 
+                end_time = start_time + duration
+                if start_time <= now <= end_time:
+                    is_running = True
+                elif now < start_time:
+                    yet_to_start = True
+                    if 0 <= (start_time - now).total_seconds() <= upcoming_event_in:
+                        upcoming_timer = True   
+                elif end_time < now:
+                    finished = True
+
             fill_color = "#90EE90"
             if is_running:
                 fill_color = running_color
@@ -269,54 +1264,649 @@ def create_image(df):
             if upcoming_timer:
                 fill_color = upcoming_color
 
-            draw.rectangle([(x_position, y_position), (x_position + column_widths[col_idx], y_position + row_height * max_lines)],
-                            outline="black", fill=fill_color)
+            models.append((tuple(wrapped_texts), fill_color, max_lines))
+            starts.append(start_time if isinstance(start_time, datetime) else None)
+            state = "upcoming" if upcoming_timer else "finished" if finished else "yet_to_start" if yet_to_start else "running" if is_running else "unknown"
+            board_event = {header: row[header].isoformat() if isinstance(row[header], datetime) else row[header] for header in headers}
+            board_event.update(state=state, color=fill_color)
+            board_events.append(board_event)
 
-            for line_num, line in enumerate(wrapped_texts[col_idx]):
-                left, top, right, bottom = draw.textbbox((x_position, y_position), line, font=font)
-                text_width = right - left
-                text_height = bottom - top
-                x_text = x_position + (column_widths[col_idx] - text_width) // 2
-                y_text = y_position + (row_height * max_lines - text_height) // 2 + line_num * 30
-                draw.text((x_text, y_text), line, font=font, fill="black")
+    # Rows are packed by their wrapped height, the rest spill onto pages that take turns every page_interval seconds
+    with stage_timer("paginate"):
+        pages = paginate_rows([model[2] for model in models], row_height, screen_height - (y_start + row_height) - 1)
+    pages = pages[:max(1, max_pages)] if page_interval else pages[:1]
 
-        y_position += row_height * max_lines
+    target_frames = target['frames']
+    repainted = 0
+    for page_number, (first, last) in enumerate(pages):
+        page = target_frames.setdefault(page_number, {})
+        title = latest_file if len(pages) == 1 else f"{latest_file}  ({page_number + 1}/{len(pages)})"
+        with stage_timer("repaint"):
+            repainted += render_page(page, models[first:last], base, target['base_layer']['key'], font, title, scale,
+                                     column_widths, x_start, y_start, row_height)
 
-    image = image.convert('RGB')
-    image.save(os.path.join(os.getcwd(), 'output_image.png'))
-    logger.info("Image created: output_image.png")
-    
-def play_audio():
-    audio_files = glob.glob("audio.*")  # Search for audio files
+        # Identical pixels mean nothing to encode
+        with stage_timer("frame_digest"):
+            digest = hashlib.blake2b(page['image'].tobytes(), digest_size=16).hexdigest()
+        if page.get('digest') != digest:
+            # Encoded once, the same bytes go to every sink and every HTTP client
+            with stage_timer("encode"):
+                page['data'] = encode_image(page['image'].convert('RGB'), target['format'])
+            page['digest'] = digest
+        page['starts'] = starts[first:last]
+        page['events'] = board_events[first:last]
+        page['records'] = rows[first:last]
+        page['geometry'] = (base, font, column_widths, x_start, row_height)
+    for page_number in [number for number in target_frames if number >= len(pages)]:
+        del target_frames[page_number]
+    logger.info(f"Repainted {repainted} of {len(models)} rows on {len(pages)} page(s) for {target['name']}")
+
+    return show_page(target, current_page(len(pages)), now)
+
+def paginate_rows(line_counts, row_height, available_height):
+    # (first, last) row ranges that fit the table area, at most display_rows each, a row taller than a page gets its own
+    pages = []
+    first, used = 0, 0
+    for index, lines in enumerate(line_counts):
+        height = row_height * lines
+        if index > first and (used + height > available_height or index - first >= display_rows):
+            pages.append((first, index))
+            first, used = index, 0
+        used += height
+    pages.append((first, len(line_counts)))
+    return pages
 
-    if audio_files:
-        file_to_play = audio_files[0]  # Play the first matching file
-        logger.info(f"Playing: {file_to_play}")
+def render_page(page, models, base, base_key, font, title, scale, column_widths, x_start, y_start, row_height):
+    # Only row bands whose content, colour or position changed are repainted on the page's previous frame
+    screen_width, screen_height = base.size
+    frame_key = (base_key, title)
+    if page.get('key') == frame_key:
+        image = page['image']
+        previous_rows = page['rows']
+        previous_bottom = page['bottom']
+    else:
+        image = base.copy()
+        draw = ImageDraw.Draw(image)
+        file_name_x = screen_width // 2.2 - (draw.textbbox((0, 0), title, font=font)[2] // 2)
+        font_filename = get_font(round(40 * scale))
+        draw.text((file_name_x, round(30 * scale)), title, font=font_filename, fill="white")
+        previous_rows = []
+        previous_bottom = y_start + row_height
+
+    y_position = y_start + row_height
+    rendered_rows = []
+    repainted = 0
+    for row_num, model in enumerate(models):
+        # Rows pushed below the bottom edge have nothing to paint
+        if y_position < screen_height and (row_num >= len(previous_rows) or previous_rows[row_num] != (model, y_position)):
+            # Each band is drawn clipped so overflowing text cannot leak into untouched rows
+            box = (0, y_position, screen_width, min(screen_height, y_position + row_height * model[2] + 1))
+            band = base.crop(box)
+            draw_row(ImageDraw.Draw(band), model, 0, font, column_widths, x_start, row_height)
+            image.paste(band, box[:2])
+            repainted += 1
+        rendered_rows.append((model, y_position))
+        y_position += row_height * model[2]
 
+    if previous_bottom > y_position and y_position + 1 < screen_height:
+        box = (0, y_position + 1, screen_width, min(screen_height, previous_bottom + 1))
+        image.paste(base.crop(box), box[:2])
+
+    page['key'] = frame_key
+    page['image'] = image
+    page['rows'] = rendered_rows
+    page['bottom'] = y_position
+    return repainted
+
+def current_page(count):
+    return int(time.time() // page_interval) % count if page_interval and count > 1 else 0
+
+def show_page(target, page_number, now):
+    # Rotating only swaps in a page drawn and encoded earlier
+    page = target['frames'][page_number]
+    shown = target['shown']
+    shown['number'] = page_number
+    primary = target is get_render_targets()[0]
+    if primary:
+        # Pages drawn in advance are journaled when they come up, not when they are drawn
+        journal_board(page['records'], [board_event['state'] for board_event in page['events']])
+    if primary and display_mode == "window":
+        with stage_timer("live_window"):
+            publish_frame(page['image'], page['rows'], page['starts'], *page['geometry'], now)
+    if primary and (shown.get('digest') != page['digest'] or shown.get('events') != page['events']):
+        # A state change can keep its colour, so the events feed follows the rows rather than the pixels
+        with stage_timer("publish"):
+            publish_board(page['data'], page['digest'], page['events'])
+        shown['events'] = page['events']
+    if shown.get('digest') == page['digest']:
+        logger.info(f"Frame unchanged for {target['name']}, skipping save")
+        return None
+    shown['digest'] = page['digest']
+    return {'data': page['data'], 'digest': page['digest'], 'format': target['format'],
+            'target': target['name'], 'path': target['path'], 'sinks': target['sinks']}
+
+def rotate_page():
+    frames = []
+    for target in get_render_targets():
+        pages = target['frames']
+        if len(pages) <= 1:
+            continue
+        page_number = current_page(len(pages))
+        if page_number != target['shown'].get('number'):
+            logger.info(f"Showing page {page_number + 1} of {len(pages)} on {target['name']}")
+            frames.append(show_page(target, page_number, datetime.now()))
+    return [frame for frame in frames if frame]
+
+def next_rotation_in():
+    if not page_interval or all(len(target['frames']) <= 1 for target in get_render_targets()):
+        return None
+    # A little past the boundary so the wake-up never lands on the page still showing
+    return page_interval - time.time() % page_interval + 0.05
+
+def publish_frame(image, rendered_rows, starts, base, font, column_widths, x_start, row_height, now):
+    # The live window flashes rows by swapping in a band pre-drawn in flash_color, so only those bands are drawn here
+    screen_width, screen_height = image.size
+    layout = []
+    for (model, y_position), start_time in zip(rendered_rows, starts):
+        height = row_height * model[2]
+        flash_band = None
+        if start_time and y_position < screen_height and 0 <= (start_time - now).total_seconds() <= flash_before_minutes * 60:
+            box = (0, y_position, screen_width, min(screen_height, y_position + height + 1))
+            flash_band = base.crop(box)
+            draw_row(ImageDraw.Draw(flash_band), (model[0], flash_color, model[2]), 0, font, column_widths, x_start, row_height)
+        layout.append({'start': start_time, 'y': y_position, 'height': height, 'flash_band': flash_band})
+    display_queue.put((image.copy(), layout, x_start + sum(column_widths)))
+
+def run_live_display(start_rendering):
+    from PIL import ImageTk
+
+    # The screen is probed and the root created here on the main thread before the board thread starts,
+    # so Tk is never entered from two threads
+    screen_width, screen_height = get_screen_size()
+    root = tk.Tk()
+    root.overrideredirect(True)
+    root.geometry(f"{screen_width}x{screen_height}+0+0")
+    root.attributes('-topmost', display_topmost)
+    root.bind("<Escape>", lambda event: root.destroy())
+    canvas = tk.Canvas(root, width=screen_width, height=screen_height, highlightthickness=0, bg="black")
+    canvas.pack()
+    frame_item = canvas.create_image(0, 0, anchor="nw")
+    live = {'photos': [], 'flashing': [], 'countdowns': []}
+
+    def refresh_frame():
+        # Drain to the newest frame, the monitor thread may have rendered several since the last look
+        frame = None
         try:
-            pygame.mixer.init()  # Initialize the mixer
-            pygame.mixer.music.load(file_to_play)  # Load the audio file
-            pygame.mixer.music.play()  # Play audio
-            
-            while pygame.mixer.music.get_busy():  # Wait for audio to finish
-                pygame.time.Clock().tick(10)  
-            
-            pygame.mixer.quit()  # Release the file immediately
-            logger.info("Playback finished successfully.")
+            while True:
+                frame = display_queue.get_nowait()
+        except queue.Empty:
+            pass
+        if frame is not None:
+            image, layout, table_right = frame
+            canvas.delete("overlay")
+            live['photos'] = [ImageTk.PhotoImage(image)]
+            canvas.itemconfigure(frame_item, image=live['photos'][0])
+            live['flashing'] = []
+            live['countdowns'] = []
+            for row in layout:
+                if row['flash_band'] is not None:
+                    photo = ImageTk.PhotoImage(row['flash_band'])
+                    live['photos'].append(photo)
+                    item = canvas.create_image(0, row['y'], anchor="nw", image=photo, state="hidden", tags="overlay")
+                    live['flashing'].append((item, row['start']))
+                if row['start'] is not None:
+                    badge = canvas.create_rectangle(0, 0, 0, 0, fill="black", outline="", state="hidden", tags="overlay")
+                    text = canvas.create_text(table_right - 8, row['y'] + row['height'] - 4, anchor="se", font=("Arial", -txt_size, "bold"),
+                                              fill="white", state="hidden", tags="overlay")
+                    live['countdowns'].append((badge, text, row['start']))
+            tick()
+        root.after(200, refresh_frame)
 
-        except Exception as e:
-            logger.error(f"Error playing sound: {e}")
+    def tick():
+        # Only canvas item states and countdown texts change between frames
+        now = datetime.now()
+        flash_on = int(time.time() / max(flash_freq, 0.1)) % 2 == 0
+        for item, start_time in live['flashing']:
+            flashing = 0 <= (start_time - now).total_seconds() <= flash_before_minutes * 60
+            canvas.itemconfigure(item, state="normal" if flash_on and flashing else "hidden")
+        for badge, text, start_time in live['countdowns']:
+            remaining = int((start_time - now).total_seconds())
+            if 0 < remaining <= upcoming_event_in:
+                hours, rest = divmod(remaining, 3600)
+                canvas.itemconfigure(text, text=f"T-{hours:02d}:{rest // 60:02d}:{rest % 60:02d}", state="normal")
+                x1, y1, x2, y2 = canvas.bbox(text)
+                canvas.coords(badge, x1 - 4, y1, x2 + 4, y2)
+                canvas.itemconfigure(badge, state="normal")
+            else:
+                canvas.itemconfigure(text, state="hidden")
+                canvas.itemconfigure(badge, state="hidden")
+
+    def tick_loop():
+        tick()
+        root.after(max(100, min(1000, int(flash_freq * 500))), tick_loop)
+
+    start_rendering()
+    refresh_frame()
+    tick_loop()
+    root.mainloop()
+
+def encode_image(image, image_format=None):
+    image_format = image_format or output_format
+    buffer = io.BytesIO()
+    if image_format == "jpg":
+        image.save(buffer, format="JPEG", quality=jpeg_quality)
+    elif image_format == "bmp":
+        image.save(buffer, format="BMP")
     else:
+        image.save(buffer, format="PNG", compress_level=png_compress_level)
+    return buffer.getvalue()
+
+def save_image(data, file_name=None):
+    file_name = file_name or f"output_image.{output_format}"
+    image_path = os.path.join(os.getcwd(), file_name)
+    root, extension = os.path.splitext(image_path)
+    temp_path = f"{root}.tmp{extension}"
+    # The wallpaper never sees a half written file, the lock keeps sinks writing the same file apart
+    with image_lock:
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+        os.replace(temp_path, image_path)
+    logger.info(f"Image created: {file_name}")
+    return image_path
+
+def publish_board(data, digest, events):
+    with board_changed:
+        version = board_state['version'] + 1
+        board_state.update(
+            version=version,
+            image=data,
+            image_etag=f'"{digest}"',
+            events=json.dumps({'version': version, 'title': latest_file, 'rendered': datetime.now().isoformat(),
+                               'events': events}, default=str).encode('utf-8'),
+            events_etag=f'"events-{version}"',
+        )
+        board_changed.notify_all()
+
+class BoardRequestHandler(BaseHTTPRequestHandler):
+    # GET /board.<format> and /events.json honour If-None-Match, add ?wait=<seconds> to long-poll for the next board,
+    # GET /events streams a server-sent event with the events feed whenever the board changes, /metrics has stage timings
+    protocol_version = "HTTP/1.1"
+    content_types = {"png": "image/png", "jpg": "image/jpeg", "bmp": "image/bmp"}
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+        try:
+            if url.path in ("/board", f"/board.{output_format}"):
+                self.send_conditional('image', self.content_types[output_format], params)
+            elif url.path == "/events.json":
+                self.send_conditional('events', "application/json", params)
+            elif url.path == "/events":
+                self.stream_events()
+            elif url.path == "/metrics":
+                body = json.dumps(metrics_snapshot(), indent=2).encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Cache-Control", "no-cache")
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(body)
+            else:
+                self.send_error(404)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    do_HEAD = do_GET
+
+    def send_conditional(self, key, content_type, params):
+        known = self.headers.get("If-None-Match")
+        try:
+            wait = float(params.get('wait', ['0'])[0] or 0)
+            if not wait >= 0:
+                raise ValueError(wait)
+        except ValueError:
+            self.send_error(400, "wait is a number of seconds")
+            return
+        wait = min(wait, 300)
+        with board_changed:
+            board_changed.wait_for(lambda: board_state.get(f'{key}_etag') not in (None, known), timeout=wait)
+            body, etag = board_state.get(key), board_state.get(f'{key}_etag')
+
+        if body is None:
+            self.send_error(503, "Board not rendered yet")
+        elif etag == known:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(body)
+
+    def stream_events(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+        self.close_connection = True
+        version = 0
+        while True:
+            with board_changed:
+                board_changed.wait_for(lambda: board_state['version'] != version, timeout=15)
+                changed = board_state['version'] != version
+                version, events = board_state['version'], board_state.get('events')
+            if changed and events is not None:
+                self.wfile.write(f"id: {version}\nevent: board\ndata: ".encode('utf-8') + events + b"\n\n")
+            else:
+                self.wfile.write(b": keepalive\n\n")
+            self.wfile.flush()
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+def start_http_server():
+    server = ThreadingHTTPServer((http_host, http_port), BoardRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Serving board on http://{http_host}:{http_port}/board.{output_format}")
+    return server
+    
+def event_id(row):
+    start = row.get("IST(+ 5.5)")
+    start = start.strftime("%Y-%m-%d %H:%M") if isinstance(start, datetime) else str(start)
+    return f"{start}|{row.get('CHANNEL', '')}|{row.get('CIRCUIT', '')}"
+
+def journal_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ', timespec='seconds')
+    return None if value is None or value == '' else str(value)
+
+def open_journal(path):
+    connection = sqlite3.connect(path, check_same_thread=False)
+    # WAL keeps every committed row through a crash or power cut and never blocks a report reading alongside
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute("CREATE TABLE IF NOT EXISTS journal (at TEXT NOT NULL, event TEXT NOT NULL, kind TEXT NOT NULL, detail TEXT, "
+                       "start TEXT, channel TEXT, description TEXT, circuit TEXT, planner TEXT)")
+    connection.execute("CREATE INDEX IF NOT EXISTS journal_start ON journal (start)")
+    return connection
+
+def get_journal():
+    # Opened on first use, so pool processes importing this module never touch it
+    global journal
+    if journal is None:
+        journal = False
+        if journal_file:
+            try:
+                journal = open_journal(journal_file)
+                # Board states and alarms of recent events survive a restart, so nothing is journaled or sounded twice
+                since = journal_value(datetime.now() - timedelta(days=2))
+                for event, kind, detail in journal.execute("SELECT event, kind, detail FROM journal WHERE start >= ? ORDER BY rowid", (since,)):
+                    if kind == "alarm":
+                        alarmed_events.add((event, detail))
+                    else:
+                        journal_states[event] = kind
+                logger.info(f"Journal {journal_file}: {len(journal_states)} recent events, {len(alarmed_events)} alarms already raised")
+            except sqlite3.Error as e:
+                logger.error(f"Could not open journal {journal_file}: {e}")
+                journal = False
+    return journal
+
+def journal_write(entries):
+    # (kind, detail, row) entries of one cycle go in one transaction
+    connection = get_journal()
+    if not connection or not entries:
+        return
+    at = journal_value(datetime.now())
+    try:
+        with journal_lock, connection:
+            connection.executemany("INSERT INTO journal VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", [
+                (at, event_id(row), kind, detail, journal_value(row.get("IST(+ 5.5)")), journal_value(row.get("CHANNEL")),
+                 journal_value(row.get("DESCRIPTION")), journal_value(row.get("CIRCUIT")), latest_file)
+                for kind, detail, row in entries])
+    except sqlite3.Error as e:
+        logger.error(f"Could not write to journal {journal_file}: {e}")
+
+def journal_board(rows, states):
+    # Only the first render that shows an event in a new state is journaled
+    if not get_journal():
+        return
+    entries = []
+    for row, state in zip(rows, states):
+        key = event_id(row)
+        if state != "unknown" and journal_states.get(key) != state:
+            journal_states[key] = state
+            entries.append((state, None, row))
+    journal_write(entries)
+
+def print_report(day):
+    # Per event of that day: when it was alarmed, went running on the board and finished
+    if not os.path.exists(journal_file):
+        print(f"No journal at {journal_file}")
+        return
+    try:
+        start_of_day = datetime.strptime(day, "%Y-%m-%d")
+    except ValueError:
+        print(f"Expected a day like 2025-03-14, got {day}")
+        return
+    connection = sqlite3.connect(journal_file)
+    rows = connection.execute(
+        "SELECT start, channel, circuit, description, MIN(CASE WHEN kind = 'alarm' THEN at END), "
+        "MIN(CASE WHEN kind = 'running' THEN at END), MIN(CASE WHEN kind = 'finished' THEN at END) "
+        "FROM journal WHERE start >= ? AND start < ? GROUP BY event ORDER BY start",
+        (journal_value(start_of_day), journal_value(start_of_day + timedelta(days=1)))).fetchall()
+    connection.close()
+    print(f"{'START':<20} {'CHANNEL':<20} {'CIRCUIT':<8} {'ALARM':<9} {'RUNNING':<9} {'FINISHED':<9} DESCRIPTION")
+    for start, channel, circuit, description, alarm, running, finished in rows:
+        alarm, running, finished = (at[11:19] if at else "-" for at in (alarm, running, finished))
+        print(f"{start:<20} {(channel or '')[:20]:<20} {(circuit or '')[:8]:<8} {alarm:<9} {running:<9} {finished:<9} {description or ''}")
+    print(f"{len(rows)} live events on {day}")
+
+def queue_alarm(row, threshold="audio_before"):
+    # Each event alarms once per threshold, however many renders it appears in and across restarts
+    global alarm_thread
+    get_journal()
+    event_key = event_id(row)
+    if (event_key, threshold) in alarmed_events:
+        return
+    alarmed_events.add((event_key, threshold))
+    journal_write([("alarm", threshold, row)])
+    if alarm_thread is None:
+        alarm_thread = threading.Thread(target=alarm_worker, name="alarm", daemon=True)
+        alarm_thread.start()
+    alarm_queue.put(event_key)
+
+def load_alarm_sound():
+    audio_files = glob.glob("audio.*")  # Search for audio files
+    if not audio_files:
         logger.error("No audio files found with name 'audio.*'")
+        return None
+    try:
+        if not pygame.mixer.get_init():
+            pygame.mixer.init()
+        sound = pygame.mixer.Sound(audio_files[0])
+        logger.info(f"Loaded alarm clip {audio_files[0]}")
+        return sound
+    except Exception as e:
+        logger.error(f"Error loading sound: {e}")
+        return None
+
+def alarm_worker():
+    sound = load_alarm_sound()
+    while True:
+        events = [alarm_queue.get()]
+        # Alarms raised together or while the clip was playing share one playback
+        while not alarm_queue.empty():
+            events.append(alarm_queue.get_nowait())
+        if sound is None:
+            sound = load_alarm_sound()
+            if sound is None:
+                continue
+        logger.info(f"Playing alarm for {', '.join(events)}")
+        with collect_stages() as stages:
+            try:
+                with stage_timer("alarm_playback"):
+                    channel = sound.play()
+                    while channel is not None and channel.get_busy():
+                        time.sleep(0.1)
+                logger.info("Playback finished successfully.")
+            except Exception as e:
+                logger.error(f"Error playing sound: {e}")
+        record_stages("alarm", stages, events=len(events))
+
+class OutputSink(ABC):
+    # Each sink delivers on its own thread from a one-frame slot, a slow sink drops stale frames instead of holding up rendering
+    def __init__(self, name):
+        self.name = name
+        self.pending = {}
+        self.failed = {}
+        self.ready = threading.Condition()
+        threading.Thread(target=self.run, name=f"sink-{name}", daemon=True).start()
+
+    def submit(self, frame):
+        # One slot per render target
+        with self.ready:
+            if frame['target'] in self.pending:
+                logger.info(f"Output sink {self.name} is busy, replacing its pending {frame['target']} frame")
+            self.pending[frame['target']] = frame
+            self.ready.notify()
+
+    def run(self):
+        while True:
+            with self.ready:
+                # Frames are only sent again when the picture changes, so a failed one is retried after run_frequency
+                # seconds unless a newer frame for its target arrives first
+                if not self.ready.wait_for(lambda: self.pending, timeout=run_frequency if self.failed else None):
+                    logger.info(f"Retrying output sink {self.name} for {', '.join(self.failed)}")
+                    self.pending, self.failed = self.failed, {}
+                frames, self.pending = list(self.pending.values()), {}
+            for frame in frames:
+                with collect_stages() as stages:
+                    try:
+                        with stage_timer(f"sink_{self.name}"):
+                            self.deliver(frame)
+                    except Exception as e:
+                        logger.error(f"Output sink {self.name} failed for {frame['target']}: {e}")
+                        with self.ready:
+                            self.failed[frame['target']] = frame
+                    else:
+                        with self.ready:
+                            self.failed.pop(frame['target'], None)
+                record_stages("sink", stages, sink=self.name, target=frame['target'])
+
+    @abstractmethod
+    def deliver(self, frame):
+        pass
 
+class FileSink(OutputSink):
+    def deliver(self, frame):
+        with stage_timer("save"):
+            return save_image(frame['data'], frame['path'])
+
+class WallpaperSink(FileSink):
+    def deliver(self, frame):
+        image_path = super().deliver(frame)
+        with stage_timer("set_as_wallpaper"):
+            set_as_wallpaper(image_path)
+
+class DesktopSink(OutputSink):
+    # GNOME only reloads the background when its URI changes, so two file names take turns
+    def __init__(self, name):
+        self.turn = 0
+        super().__init__(name)
+
+    def deliver(self, frame):
+        self.turn ^= 1
+        root, extension = os.path.splitext(frame['path'] or f"output_image.{frame['format']}")
+        image_path = save_image(frame['data'], f"{root}.{self.turn}{extension}")
+        for command in desktop_commands(image_path):
+            result = subprocess.run(command, capture_output=True, text=True, timeout=30)
+            if result.returncode:
+                logger.warning(f"{' '.join(command)} exited with {result.returncode}: {result.stderr.strip()}")
+        logger.info("Desktop background set")
+
+class HttpPushSink(OutputSink):
+    def deliver(self, frame):
+        request = urllib.request.Request(push_url, data=frame['data'], method="POST", headers={
+            "Content-Type": BoardRequestHandler.content_types[frame['format']],
+            "ETag": f'"{frame["digest"]}"',
+        })
+        with urllib.request.urlopen(request, timeout=30) as response:
+            logger.info(f"Pushed board to {push_url}: {response.status}")
+
+sink_types = {"wallpaper": WallpaperSink, "file": FileSink, "desktop": DesktopSink, "http_push": HttpPushSink}
+
+def desktop_commands(image_path):
+    if desktop_command:
+        return [[arg.replace("{path}", image_path) for arg in shlex.split(desktop_command)]]
+    if shutil.which("feh"):
+        return [["feh", "--no-fehbg", "--bg-max", image_path]]
+    if shutil.which("gsettings"):
+        uri = "file://" + image_path
+        return [["gsettings", "set", "org.gnome.desktop.background", key, uri] for key in ("picture-uri", "picture-uri-dark")]
+    raise RuntimeError("Neither feh nor gsettings found, set desktop_command in values.txt")
+
+def select_sink_names():
+    names = [name.strip().lower() for name in output_sinks.split(',') if name.strip()]
+    if names != ["auto"]:
+        return names
+    if display_mode != "wallpaper":
+        return ["file"]
+    if sys.platform == "win32":
+        return ["wallpaper"]
+    if (os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY")) and (desktop_command or shutil.which("feh") or shutil.which("gsettings")):
+        return ["desktop"]
+    return ["file"]
+
+def get_output_sinks(names=None):
+    # Started on first use so worker processes importing this module do not spawn sink threads
+    sinks = []
+    for name in select_sink_names() if names is None else names:
+        if name not in output_sink_registry:
+            output_sink_registry[name] = None
+            if name not in sink_types:
+                logger.error(f"Unknown output sink {name}, expected one of {', '.join(sink_types)}")
+            elif name == "http_push" and not push_url:
+                logger.error("The http_push sink needs push_url in values.txt")
+            else:
+                output_sink_registry[name] = sink_types[name](name)
+                logger.info(f"Started output sink {name}")
+        if output_sink_registry[name] is not None:
+            sinks.append(output_sink_registry[name])
+    return sinks
+
+def dispatch_frame(frame):
+    for sink in get_output_sinks(frame.get('sinks')):
+        sink.submit(frame)
 
 def set_as_wallpaper(image_path):
     ctypes.windll.user32.SystemParametersInfoW(20, 0, image_path, 0)
     logger.info("Wallpaper set")
 
 if __name__ == "__main__":
-    
+    multiprocessing.freeze_support()
+    parser = argparse.ArgumentParser(description="Live events board")
+    parser.add_argument("--report", nargs="?", const=datetime.now().strftime("%Y-%m-%d"), metavar="YYYY-MM-DD",
+                        help="print what the journal recorded for the events starting that day, today by default, and exit")
+    args = parser.parse_args()
+    if args.report:
+        print_report(args.report)
+        sys.exit(0)
     #current_dir = os.path.dirname(os.path.abspath(__file__))
     #print(current_dir)
     current_dir = os.getcwd()
-    monitor_directory(current_dir)
\ No newline at end of file
+    preload_assets()
+    if http_port:
+        start_http_server()
+    if display_mode == "window":
+        # Tk has to own the main thread, the board is rendered in the background and handed over through display_queue
+        run_live_display(threading.Thread(target=monitor_directory, args=(current_dir,), daemon=True).start)
+    else:
+        monitor_directory(current_dir)
\ No newline at end of file
@@ -0,0 +1,255 @@
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import statistics
+import tempfile
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+
+import pandas as pd
+import openpyxl
+
+import app
+
+resolutions = [(1920, 1080), (3840, 2160)]
+
+
+def synthetic_planner(rows, seed=0):
+    # Same shape read_excel gives for the PLANNER sheet, CHANNEL spilling into "Unnamed: 8"
+    rng = random.Random(seed)
+    start = datetime.now().replace(second=0, microsecond=0)
+    return pd.DataFrame({
+        "Unnamed: 0": [None] * rows,
+        "IST(+ 5.5)": [start + timedelta(minutes=15 * rng.randrange(4 * 24 * 28)) for _ in range(rows)],
+        "DUR": [rng.choice([0.5, 1.0, 1.5, 2.25, 3.0]) for _ in range(rows)],
+        "TELECAST": [rng.choice(["LIVE", "LIVE/STREAM", "RECORDING", "DELAYED"]) for _ in range(rows)],
+        "DESCRIPTION": [f"I-LEAGUE 2024-25: Team {rng.randrange(40)} vs. Team {rng.randrange(40)}" for _ in range(rows)],
+        "CHANNEL": [rng.choice(["SS 2/SS 2 HD", "SS 1", "SS 3 HINDI", None]) for _ in range(rows)],
+        "Unnamed: 8": [rng.choice(["HD", None, None]) for _ in range(rows)],
+        "LINE INPUT": [f"LN {rng.randrange(1, 12):02d}" for _ in range(rows)],
+        "SOURCE": [rng.choice(["INTERFACE 11", "ENCOMPASS", "MALAD"]) for _ in range(rows)],
+        "CIRCUIT": [f"D{rng.randrange(1, 40)}" for _ in range(rows)],
+    })
+
+
+def synthetic_workbook(path, rows, seed=0):
+    # PLANNER sheet laid out like the real planners: two banner rows skipped by skiprows=2, headers on row 3,
+    # merged CHANNEL cells spilling into an untitled column, live and non-live TELECAST, fractional DUR.
+    # Events spread from a day ago to four weeks ahead so the finished-event filter has work to do.
+    rng = random.Random(seed)
+    start = datetime.now().replace(second=0, microsecond=0) - timedelta(days=1)
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("PLANNER")
+    sheet.append([None, None, None, "LIVE EVENTS PLANNER"])
+    sheet.append([])
+    sheet.append([None, "GMT START", "GMT END", "IST(+ 5.5)", "DUR", "TELECAST", "DESCRIPTION", "CHANNEL", None,
+                  "LINE INPUT", "SOURCE", "CIRCUIT"])
+    for _ in range(rows):
+        ist = start + timedelta(minutes=15 * rng.randrange(4 * 24 * 29))
+        duration = rng.choice([0.25, 0.5, 1.0, 1.5, 2.25, 3.0])
+        sheet.append([
+            None, ist - timedelta(hours=5.5), ist - timedelta(hours=5.5 - duration), ist, duration,
+            rng.choice(["LIVE", "LIVE/STREAM", "Live", "RECORDING", "DELAYED", "HIGHLIGHTS"]),
+            f"I-LEAGUE 2024-25: Team {rng.randrange(40)} vs. Team {rng.randrange(40)}" + rng.choice(["", " (Extended Coverage)"]),
+            rng.choice(["SS 2/SS 2 HD", "SS 1", "SS 3 HINDI", "SS KHEL/SS 2 SD", None]),
+            rng.choice(["HD", None, None]),
+            f"LN {rng.randrange(1, 12):02d}",
+            rng.choice(["INTERFACE 11", "ENCOMPASS", "MALAD"]),
+            f"D{rng.randrange(1, 40)}",
+        ])
+    workbook.save(path)
+
+
+def rowwise_merge_channel_columns(df):
+    # Implementation process_file used before it was vectorized, kept as the baseline
+    channel_index = df.columns.get_loc("CHANNEL")
+    for split_col in [col for col in df.columns[channel_index + 1:] if "Unnamed:" in str(col)]:
+        df["CHANNEL"] = df.apply(
+            lambda row: str(row["CHANNEL"]) + " " + str(row[split_col]) if pd.notna(row[split_col]) else str(row["CHANNEL"]),
+            axis=1
+        )
+        df = df.drop(columns=[split_col])
+    return df
+
+
+def rowwise_compute_end_time(df):
+    return df.apply(
+        lambda row: row['IST(+ 5.5)'] + timedelta(hours=int(row['DUR']), minutes=(row['DUR'] % 1) * 60) + timedelta(minutes=app.grace_period)
+        if pd.notna(row['IST(+ 5.5)']) and pd.notna(row['DUR'])
+        else None, axis=1
+    )
+
+
+def best_of(function, df, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        frame = df.copy()
+        started = time.perf_counter()
+        function(frame)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def time_calls(function, repeat, setup=None):
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return {'best_ms': round(min(timings) * 1000, 3), 'median_ms': round(statistics.median(timings) * 1000, 3), 'runs': repeat}
+
+
+def use_resolution(width, height):
+    # Same override as width/height in values.txt, so nothing probes a display
+    app.configured_width, app.configured_height = width, height
+    app.base_layer_cache.clear()
+    app.frame_cache.clear()
+
+
+def reset_parse_caches():
+    app.schedule_cache.clear()
+    app.merged_cache.clear()
+
+
+def ingest_planners(paths):
+    # Cold merge through the ingestion pool, polled the way the monitor loop picks up finished jobs
+    reset_parse_caches()
+    app.failed_planners.clear()
+    while not all(path in app.schedule_cache or path in app.failed_planners for path in paths):
+        app.load_planners(paths)
+        time.sleep(0.01)
+    return app.load_planners(paths)
+
+
+def reset_text_caches():
+    app.wrap_cache.clear()
+    app.text_measure_cache.clear()
+
+
+def run_suite(sizes, repeat, workdir):
+    app.ingest_workers = 0
+    app.watch_debounce = 0  # Generated workbooks are complete, do not wait for them to settle
+    app.schedule_snapshot = False
+    app.audio_alarm = False
+    app.journal_file = ""  # Synthetic events stay out of the show journal
+    # One page of the board at one resolution, whatever values.txt asks for
+    app.page_interval = 0
+    app.render_targets = ""
+    app.render_target_list = None
+    app.latest_file = "benchmark planner"
+    results = {}
+
+    for rows in sizes:
+        df = synthetic_planner(rows)
+        for step, baseline, vectorized in [
+            ("merge_channel_columns", rowwise_merge_channel_columns, app.merge_channel_columns),
+            ("compute_end_time", rowwise_compute_end_time, app.compute_end_time),
+        ]:
+            results[f"{step}[rows={rows},row-wise]"] = {'best_ms': round(best_of(baseline, df, repeat=1 if rows >= 100000 else repeat) * 1000, 3)}
+            results[f"{step}[rows={rows}]"] = {'best_ms': round(best_of(vectorized, df, repeat=repeat) * 1000, 3)}
+
+    use_resolution(*resolutions[0])
+    stores = {}
+    for rows in sizes:
+        path = os.path.join(workdir, f"planner_{rows}.xlsx")
+        if not os.path.exists(path):
+            synthetic_workbook(path, rows)
+        # Parsing alone, the board is timed by create_image below
+        results[f"load_planners[rows={rows}]"] = time_calls(lambda: app.load_planners([path]), repeat, setup=reset_parse_caches)
+        stores[rows] = app.get_event_store(app.load_planners([path]))
+
+    # Several planners merged through the process pool, one of them corrupt. The good ones have to end up on the
+    # board whatever order the jobs finish in, or the numbers are not worth comparing.
+    rows = sizes[0]
+    paths = [os.path.join(workdir, f"merged_{rows}_{seed}.xlsx") for seed in range(5)]
+    for seed, path in enumerate(paths):
+        if not os.path.exists(path):
+            synthetic_workbook(path, rows, seed=seed)
+    paths.append(os.path.join(workdir, "corrupt.xlsx"))
+    with open(paths[-1], 'wb') as file:
+        file.write(b"not a workbook")
+    expected = len(ingest_planners(paths))
+    app.ingest_workers = 2
+    merged = ingest_planners(paths)
+    if len(merged) != expected or set(app.failed_planners) != {paths[-1]}:
+        raise RuntimeError(f"Pool ingestion merged {len(merged)} events instead of {expected}")
+    results[f"ingest_pool[planners={len(paths)},rows={rows}]"] = time_calls(lambda: ingest_planners(paths), repeat)
+    app.ingest_workers = 0
+
+    font = app.get_font(app.font_size)
+    for rows, store in stores.items():
+        # Cells of up to the first thousand live events
+        records = store.records[:1000]
+        for width, height in resolutions:
+            widths = [int(width * fraction) - 20 for fraction in app.column_fractions]
+            cells = [(str(record[header]), widths[index]) for record in records for index, header in enumerate(app.required_columns)]
+            app.fit_wrap_cache(len(cells))
+
+            def wrap_all():
+                for text, max_width in cells:
+                    app.wrap_text(text, font, max_width)
+            results[f"wrap_text[rows={rows},{width}x{height},cold]"] = time_calls(wrap_all, repeat, setup=reset_text_caches)
+            results[f"wrap_text[rows={rows},{width}x{height},warm]"] = time_calls(wrap_all, repeat)
+
+    visible = stores[sizes[-1]].visible(datetime.now(), app.display_rows)
+    for width, height in resolutions:
+        use_resolution(width, height)
+        label = f"{width}x{height}"
+        results[f"create_image[{label},cold]"] = time_calls(lambda: app.create_image(visible), repeat,
+                                                           setup=lambda: (use_resolution(width, height), reset_text_caches()))
+        results[f"create_image[{label},full]"] = time_calls(lambda: app.create_image(visible), repeat, setup=app.frame_cache.clear)
+        results[f"create_image[{label},unchanged]"] = time_calls(lambda: app.create_image(visible), repeat)
+
+    return results
+
+
+def compare(results, baseline_path, threshold):
+    with open(baseline_path) as file:
+        baseline = json.load(file)['results']
+    regressions = 0
+    print(f"{'benchmark':<52} {'before':>10} {'after':>10} {'change':>8}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]['best_ms'], result['best_ms']
+        change = (after - before) / before if before else 0
+        flag = " slower" if change > threshold else ""
+        regressions += bool(flag)
+        print(f"{name:<52} {before:>8.2f}ms {after:>8.2f}ms {change:>+7.0%}{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark parsing and rendering on synthetic PLANNER workbooks")
+    parser.add_argument("sizes", nargs="*", type=int, default=[1000, 10000, 100000], help="planner rows per workbook")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file the results are written to")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="slowdown reported as a regression, 0.1 is 10%%")
+    parser.add_argument("--workdir", help="keep generated workbooks here instead of a temporary folder")
+    args = parser.parse_args()
+
+    app.logger.setLevel(logging.WARNING)
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+    # Generated workbooks reach 100k rows each, they are removed afterwards unless --workdir keeps them
+    with nullcontext(args.workdir) if args.workdir else tempfile.TemporaryDirectory(prefix="planner_benchmark_", ignore_cleanup_errors=True) as workdir:
+        results = run_suite(sorted(args.sizes), args.repeat, workdir)
+
+    for name, result in results.items():
+        print(f"{name:<52} {result['best_ms']:>10.2f}ms")
+    with open(args.output, 'w') as file:
+        json.dump({'created': datetime.now().isoformat(), 'python': sys.version.split()[0], 'platform': platform.platform(),
+                   'sizes': sorted(args.sizes), 'repeat': args.repeat, 'results': results, 'stages': app.metrics_snapshot()},
+                  file, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        sys.exit(1 if compare(results, args.compare, args.threshold) else 0)